@@ -1,21 +1,42 @@
-import json
+import os
 import sys
 
+import orjson
+
 # uso:
 # python scripts/jsonl_to_json.py logs/flashscore_xxx.jsonl public/flashscore_dump.json
+# python scripts/jsonl_to_json.py logs/flashscore_xxx.jsonl public/flashscore_dump.json --no-validate
+#
+# cada linea del .jsonl ya es un objeto JSON, asi que se copia tal cual
+# dentro de un array (sin re-encodear). Por defecto cada linea se parsea
+# para validar (una linea cortada, ej. de un run matado, corta con error);
+# --no-validate lo saltea. Se escribe a dst.tmp y solo se reemplaza dst
+# si todo salio bien, asi nunca queda un json roto.
 
 src = sys.argv[1]
 dst = sys.argv[2]
+validate = "--no-validate" not in sys.argv[3:]
+tmp = dst + ".tmp"
 
-rows = []
-with open(src, "r", encoding="utf-8") as f:
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-        rows.append(json.loads(line))
+count = 0
+try:
+    with open(src, "rb") as fi, open(tmp, "wb") as fo:
+        fo.write(b"[")
+        for line in fi:
+            line = line.strip()
+            if not line:
+                continue
+            if validate:
+                orjson.loads(line)
+            fo.write(b"\n" if count == 0 else b",\n")
+            fo.write(line)
+            count += 1
+        fo.write(b"\n]\n" if count else b"]\n")
+except BaseException:
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    raise
 
-with open(dst, "w", encoding="utf-8") as f:
-    json.dump(rows, f, ensure_ascii=False, indent=2)
+os.replace(tmp, dst)
 
-print(f"wrote {len(rows)} rows -> {dst}")
\ No newline at end of file
+print(f"wrote {count} rows -> {dst}")
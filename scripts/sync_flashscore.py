@@ -6,14 +6,15 @@
 
 import os
 import re
-import json
 import sys
 import asyncio
 from datetime import datetime, timezone
+from functools import lru_cache
 from contextlib import redirect_stdout, redirect_stderr
 
+import orjson
 from dotenv import load_dotenv
-from supabase import create_client
+from supabase import AsyncClientOptions, acreate_client
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
 
@@ -23,6 +24,7 @@ from playwright.async_api import async_playwright, TimeoutError as PlaywrightTim
 class Tee:
     """
     Write to file and (optionally) also to console.
+    Writes are buffered; only flush() (or closing the file) hits the disk.
     """
     def __init__(self, file_obj, also_console: bool = True):
         self.file_obj = file_obj
@@ -32,13 +34,11 @@ class Tee:
     def write(self, s):
         try:
             self.file_obj.write(s)
-            self.file_obj.flush()
         except:
             pass
         if self.also_console:
             try:
                 self.console.write(s)
-                self.console.flush()
             except:
                 pass
 
@@ -70,7 +70,27 @@ load_dotenv(".env.local")
 
 SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
-sb = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+# max in-flight PostgREST requests across all comps
+DB_CONCURRENCY = 10
+
+# created once per run in init_supabase() so every call reuses the same
+# async HTTP client (keep-alive connection pool)
+sb = None
+db_sem = None
+
+async def init_supabase():
+    global sb, db_sem
+    sb = await acreate_client(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_ROLE_KEY,
+        options=AsyncClientOptions(postgrest_client_timeout=30),
+    )
+    db_sem = asyncio.Semaphore(DB_CONCURRENCY)
+
+async def db_execute(query):
+    async with db_sem:
+        return await query.execute()
 
 
 # -------------------------
@@ -83,7 +103,16 @@ MONTHS_NUM = {
 
 MONTH_RE = r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)"
 
-BAD_EXACT = {
+# compiled once; these run for every scraped row
+DATE_RE = re.compile(rf"\b{MONTH_RE}\s+(\d{{1,2}})\b")
+TIME_RE = re.compile(r"\b(\d{1,2}):(\d{2})(?:\s?(AM|PM))?\b")
+ROUND_RE = re.compile(r"Round\s+(\d+)", re.I)
+SCORE_RE = re.compile(r"\d{1,3}")
+WS_RE = re.compile(r"\s+")
+SEASON_RE = re.compile(r"\b(20\d{2})/(20\d{2})\b")
+SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+BAD_EXACT = frozenset({
     "RUGBY UNION",
     "SOUTH AMERICA:",
     "SOUTH AMERICA",
@@ -93,42 +122,27 @@ BAD_EXACT = {
     "WORLD:",
     "ARGENTINA:",
     "USA:",
-}
+})
 
 def _clean(s: str) -> str:
     if not s:
         return ""
-    return re.sub(r"\s+", " ", s).strip()
+    return WS_RE.sub(" ", s).strip()
 
+@lru_cache(maxsize=4096)
 def slugify(s: str) -> str:
+    # team/competition names repeat across every match, so memoize.
+    # "-" is itself matched by SLUG_RE, so one pass already collapses dash runs.
     s = (s or "").strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
-    s = re.sub(r"-+", "-", s).strip("-")
-    return s
+    return SLUG_RE.sub("-", s).strip("-")
 
 def _is_bad_team(s: str) -> bool:
-    if not s:
+    # cheapest checks first
+    if not s or len(s) <= 3:
         return True
     if s in BAD_EXACT:
         return True
-    if s.isupper() and len(s) <= 25 and (":" in s or " " in s):
-        return True
-    if len(s) <= 3:
-        return True
-    return False
-
-async def _get_best_text(loc):
-    for attr in ("title", "aria-label", "data-tooltip"):
-        try:
-            v = _clean(await loc.get_attribute(attr) or "")
-            if v and len(v) > 3:
-                return v
-        except:
-            pass
-    try:
-        return _clean(await loc.inner_text())
-    except:
-        return ""
+    return len(s) <= 25 and (":" in s or " " in s) and s.isupper()
 
 
 # -------------------------
@@ -142,9 +156,14 @@ def make_log_paths(comp_slug: str, season_name: str):
     return base + ".jsonl", base + "_summary.txt"
 
 def write_jsonl(path: str, rows: list[dict]):
-    with open(path, "w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    # 1 MiB buffer: rows are batched into a few large writes
+    with open(path, "wb", buffering=1 << 20) as f:
+        f.writelines(orjson.dumps(r) + b"\n" for r in rows)
+
+SUMMARY_PREVIEW_CHARS = 500
+
+def _preview(it: dict) -> str:
+    return orjson.dumps(it).decode()[:SUMMARY_PREVIEW_CHARS]
 
 def write_summary(path: str, comp: dict, season_name: str, results_items: list, fixtures_items: list, upsert_ok: int, upsert_fail: int):
     lines = []
@@ -156,25 +175,22 @@ def write_summary(path: str, comp: dict, season_name: str, results_items: list,
     lines.append(f"upsert_fail: {upsert_fail}")
     lines.append("")
     lines.append("results_preview:")
-    for it in results_items[:5]:
-        lines.append(str(it))
+    lines.extend(_preview(it) for it in results_items[:5])
     lines.append("")
     lines.append("fixtures_preview:")
-    for it in fixtures_items[:5]:
-        lines.append(str(it))
+    lines.extend(_preview(it) for it in fixtures_items[:5])
 
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    with open(path, "wb") as f:
+        f.write("\n".join(lines).encode("utf-8"))
 
 
 # -------------------------
 # SUPABASE DB OPS
 # -------------------------
-def get_competitions_with_urls():
-    r = (
+async def get_competitions_with_urls():
+    r = await db_execute(
         sb.table("competitions")
         .select("id,name,slug,results_url,fixtures_url,standings_url")
-        .execute()
     )
     comps = []
     for c in (r.data or []):
@@ -182,77 +198,165 @@ def get_competitions_with_urls():
             comps.append(c)
     return comps
 
-def get_or_create_season(competition_id: int, season_name: str) -> int:
-    r = (
+# (competition_id, season_name) -> season id, filled once by prefetch_seasons()
+season_ids = {}
+
+async def prefetch_seasons(competition_ids: list[int]):
+    if not competition_ids:
+        return
+    r = await db_execute(
         sb.table("seasons")
-        .select("id,name")
-        .eq("competition_id", competition_id)
-        .eq("name", season_name)
-        .limit(1)
-        .execute()
+        .select("id,competition_id,name")
+        .in_("competition_id", competition_ids)
     )
-    if r.data:
-        return r.data[0]["id"]
+    for row in (r.data or []):
+        season_ids[(row["competition_id"], row["name"])] = row["id"]
 
-    ins = (
+async def get_or_create_season(competition_id: int, season_name: str) -> int:
+    key = (competition_id, season_name)
+    if key in season_ids:
+        return season_ids[key]
+
+    ins = await db_execute(
         sb.table("seasons")
         .insert({"competition_id": competition_id, "name": season_name})
-        .execute()
     )
-    return ins.data[0]["id"]
+    season_ids[key] = ins.data[0]["id"]
+    return season_ids[key]
+
+TEAM_SLUG_CHUNK_SIZE = 200
 
-def upsert_team(name: str) -> int:
-    team_slug = slugify(name)
-    r = sb.table("teams").select("id").eq("slug", team_slug).limit(1).execute()
-    if r.data:
-        return r.data[0]["id"]
-    ins = sb.table("teams").insert({"name": name, "slug": team_slug}).execute()
-    return ins.data[0]["id"]
+def _chunks(rows: list, size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+async def resolve_team_ids(names: set[str], tag: str = "") -> dict[str, int]:
+    """
+    Insert any missing teams and return {slug: id} for all of them,
+    using one upsert plus one select per chunk instead of per-team calls.
+    """
+    rows_by_slug = {}
+    for name in sorted(names):
+        team_slug = slugify(name)
+        if team_slug and team_slug not in rows_by_slug:
+            rows_by_slug[team_slug] = {"name": name, "slug": team_slug}
+
+    async def resolve_chunk(chunk: list[str]):
+        # a failed chunk only drops its own teams (and so only their matches)
+        try:
+            # ignore_duplicates keeps existing team names untouched
+            await db_execute(
+                sb.table("teams").upsert(
+                    [rows_by_slug[s] for s in chunk],
+                    on_conflict="slug",
+                    ignore_duplicates=True,
+                )
+            )
+            r = await db_execute(sb.table("teams").select("id,slug").in_("slug", chunk))
+            return r.data or []
+        except Exception as e:
+            print(f"{tag} ⚠️ team resolve failed for {', '.join(chunk)} -> {repr(e)}")
+            return []
+
+    team_ids = {}
+    chunks = _chunks(list(rows_by_slug), TEAM_SLUG_CHUNK_SIZE)
+    for data in await asyncio.gather(*[resolve_chunk(c) for c in chunks]):
+        for t in data:
+            team_ids[t["slug"]] = t["id"]
+    return team_ids
 
 def build_source_event_key(competition_slug: str, season_name: str, match_date: str, kickoff_time: str, home: str, away: str) -> str:
     return slugify(f"{competition_slug}|{season_name}|{match_date}|{kickoff_time}|{home}|{away}")
 
-def upsert_matches_bulk(season_id: int, competition_slug: str, season_name: str, items: list, source_url: str):
+def dedupe_items(items: list) -> list:
+    # same source_event_key twice (e.g. a fixture that just became a result):
+    # keep one, and a finished match (FT) beats a scheduled one
+    merged = {}
+    for it in items:
+        k = it["source_event_key"]
+        cur = merged.get(k)
+        if cur is None or (it["status"] == "FT" and cur["status"] != "FT"):
+            merged[k] = it
+    return list(merged.values())
+
+MATCH_CONFLICT_COLS = "season_id,match_date,home_team_id,away_team_id"
+UPSERT_CHUNK_SIZE = 500
+
+async def upsert_matches_bulk(season_id: int, competition_slug: str, season_name: str, items: list, source_url: str):
+    tag = f"[{competition_slug}]"
     ok = 0
     fail = 0
 
+    team_ids = await resolve_team_ids({n for it in items for n in (it["home"], it["away"])}, tag=tag)
+
+    # build payloads (one per unique conflict key, last one wins). rows it
+    # replaces share the kept row's outcome, same as the baseline where the
+    # later upsert simply overwrote the earlier one, so ok + fail == len(items)
+    payloads = {}
+    labels = {}  # conflict key -> "date home vs away", for logging by name
+    rows_per_key = {}
     for it in items:
-        try:
-            home_id = upsert_team(it["home"])
-            away_id = upsert_team(it["away"])
-
-            key = build_source_event_key(
-                competition_slug=competition_slug,
-                season_name=season_name,
-                match_date=it["match_date"],
-                kickoff_time=it["kickoff_time"],
-                home=it["home"],
-                away=it["away"],
-            )
+        home_id = team_ids.get(slugify(it["home"]))
+        away_id = team_ids.get(slugify(it["away"]))
+        if home_id is None or away_id is None:
+            fail += 1
+            print(f"{tag} ⚠️ upsert failed for {it.get('match_date')} {it.get('home')} vs {it.get('away')} -> missing team id")
+            continue
 
-            payload = {
-                "season_id": season_id,
-                "round": it.get("round"),
-                "match_date": it["match_date"],
-                "kickoff_time": it["kickoff_time"],
-                "status": it["status"],
-                "home_team_id": home_id,
-                "away_team_id": away_id,
-                "home_score": it.get("home_score"),
-                "away_score": it.get("away_score"),
-                "source": "flashscore",
-                "source_event_key": key,
-                "source_url": source_url,
-            }
-
-            sb.table("matches").upsert(
-                payload,
-                on_conflict="season_id,match_date,home_team_id,away_team_id",
-            ).execute()
-            ok += 1
+        key = build_source_event_key(
+            competition_slug=competition_slug,
+            season_name=season_name,
+            match_date=it["match_date"],
+            kickoff_time=it["kickoff_time"],
+            home=it["home"],
+            away=it["away"],
+        )
+
+        conflict_key = (it["match_date"], home_id, away_id)
+        if conflict_key in payloads:
+            print(f"{tag} ℹ️ duplicate conflict key for {it['match_date']} {it['home']} vs {it['away']} -> later row wins")
+        rows_per_key[conflict_key] = rows_per_key.get(conflict_key, 0) + 1
+
+        labels[conflict_key] = f"{it['match_date']} {it['home']} vs {it['away']}"
+        payloads[conflict_key] = {
+            "season_id": season_id,
+            "round": it.get("round"),
+            "match_date": it["match_date"],
+            "kickoff_time": it["kickoff_time"],
+            "status": it["status"],
+            "home_team_id": home_id,
+            "away_team_id": away_id,
+            "home_score": it.get("home_score"),
+            "away_score": it.get("away_score"),
+            "source": "flashscore",
+            "source_event_key": key,
+            "source_url": source_url,
+        }
+
+    async def upsert_chunk(keys: list[tuple]):
+        chunk = [payloads[k] for k in keys]
+        try:
+            await db_execute(sb.table("matches").upsert(chunk, on_conflict=MATCH_CONFLICT_COLS))
+            return sum(rows_per_key[k] for k in keys), 0
         except Exception as e:
-            fail += 1
-            print(f"⚠️ upsert failed for {it.get('match_date')} {it.get('home')} vs {it.get('away')} -> {repr(e)}")
+            print(f"{tag} ⚠️ bulk upsert failed for {len(chunk)} rows, retrying one by one -> {repr(e)}")
+
+        # fallback: per-row so one bad match doesn't sink the whole chunk
+        c_ok = 0
+        c_fail = 0
+        for k in keys:
+            try:
+                await db_execute(sb.table("matches").upsert(payloads[k], on_conflict=MATCH_CONFLICT_COLS))
+                c_ok += rows_per_key[k]
+            except Exception as e:
+                c_fail += rows_per_key[k]
+                print(f"{tag} ⚠️ upsert failed for {labels[k]} -> {repr(e)}")
+        return c_ok, c_fail
+
+    chunks = _chunks(list(payloads), UPSERT_CHUNK_SIZE)
+    for c_ok, c_fail in await asyncio.gather(*[upsert_chunk(c) for c in chunks]):
+        ok += c_ok
+        fail += c_fail
 
     return ok, fail
 
@@ -260,16 +364,24 @@ def upsert_matches_bulk(season_id: int, competition_slug: str, season_name: str,
 # -------------------------
 # SEASON + DATE LOGIC
 # -------------------------
+SEASON_TEXT_JS = """
+(sels) => {
+  for (const sel of sels) {
+    const el = document.querySelector(sel);
+    const txt = el ? el.innerText || "" : "";
+    if (/\\b20\\d{2}\\/20\\d{2}\\b/.test(txt)) return txt;
+  }
+  return null;
+}
+"""
+
 async def detect_season_name(page, fallback: str):
+    # one CDP call: first of these elements whose text carries a YYYY/YYYY season
     try:
-        for sel in [".heading__info", ".heading__name", "header", "body"]:
-            loc = page.locator(sel).first
-            if await loc.count() == 0:
-                continue
-            txt = _clean(await loc.inner_text())
-            m = re.search(r"\b(20\d{2})/(20\d{2})\b", txt)
-            if m:
-                return f"{m.group(1)}/{m.group(2)}"
+        txt = _clean(await page.evaluate(SEASON_TEXT_JS, [".heading__info", ".heading__name", "header", "body"]))
+        m = SEASON_RE.search(txt)
+        if m:
+            return f"{m.group(1)}/{m.group(2)}"
     except:
         pass
     return fallback
@@ -294,7 +406,7 @@ def build_match_date(season_name: str, mon: str, day: int) -> str:
 
 def parse_kickoff_time_from_row_text(txt: str) -> str:
     txt = txt or ""
-    tm = re.search(r"\b(\d{1,2}):(\d{2})(?:\s?(AM|PM))?\b", txt)
+    tm = TIME_RE.search(txt)
     if not tm:
         return "00:00:00"
 
@@ -313,15 +425,23 @@ def parse_kickoff_time_from_row_text(txt: str) -> str:
 # -------------------------
 # PLAYWRIGHT SCRAPE
 # -------------------------
+# candidates are probed in list order (most specific first), not page order
+COOKIE_BUTTON_SELS = [
+    "button:has-text('I Accept')",
+    "button:has-text('Accept')",
+    "button:has-text('Accept all')",
+    "button:has-text('AGREE')",
+    "button:has-text('Agree')",
+]
+SHOW_MORE_SELS = [
+    "a:has-text('Show more matches')",
+    "button:has-text('Show more matches')",
+    "a:has-text('Show more')",
+    "button:has-text('Show more')",
+]
+
 async def accept_cookies_if_any(page):
-    candidates = [
-        "button:has-text('I Accept')",
-        "button:has-text('Accept')",
-        "button:has-text('Accept all')",
-        "button:has-text('AGREE')",
-        "button:has-text('Agree')",
-    ]
-    for sel in candidates:
+    for sel in COOKIE_BUTTON_SELS:
         try:
             btn = page.locator(sel).first
             if await btn.count() > 0:
@@ -331,81 +451,119 @@ async def accept_cookies_if_any(page):
         except:
             pass
 
+ROWS_GREW_JS = "([sel, prev]) => document.querySelectorAll(sel).length > prev"
+
+async def _wait_for_more_rows(page, prev: int, timeout: int) -> bool:
+    # resolves as soon as new rows land instead of sleeping a fixed time
+    try:
+        await page.wait_for_function(ROWS_GREW_JS, arg=[".event__match", prev], timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        return False
+
 async def expand_all_events(page):
+    rows = page.locator(".event__match")
     for _ in range(10):
+        grew = False
         try:
+            prev = await rows.count()
             await page.mouse.wheel(0, 3000)
-            await page.wait_for_timeout(400)
+            grew = await _wait_for_more_rows(page, prev, 1500)
         except:
             pass
 
-        for sel in [
-            "a:has-text('Show more matches')",
-            "button:has-text('Show more matches')",
-            "a:has-text('Show more')",
-            "button:has-text('Show more')",
-        ]:
+        for sel in SHOW_MORE_SELS:
             try:
                 b = page.locator(sel).first
                 if await b.count() > 0:
+                    prev = await rows.count()
                     await b.click(timeout=1200)
-                    await page.wait_for_timeout(700)
+                    if await _wait_for_more_rows(page, prev, 3000):
+                        grew = True
             except:
                 pass
 
-async def parse_rows_to_items(page, rows, status: str):
+        # nothing new from scrolling or "Show more": the list is complete
+        if not grew:
+            break
+
+MAX_ROWS = 800
+
+# Pulls everything parse_rows_to_items needs out of the DOM in one CDP call.
+# Participant text prefers title/aria-label/data-tooltip (if > 3 chars) over innerText.
+ROWS_EXTRACT_JS = """
+([rootSel, limit, withScores]) => {
+  const best = (el) => {
+    if (!el) return null;
+    for (const attr of ["title", "aria-label", "data-tooltip"]) {
+      const v = (el.getAttribute(attr) || "").replace(/\\s+/g, " ").trim();
+      if (v.length > 3) return v;
+    }
+    return el.innerText || "";
+  };
+  return Array.from(document.querySelectorAll(rootSel)).slice(0, limit).map((r) => {
+    let hs = withScores ? r.querySelector(".event__score--home") : null;
+    let as = withScores ? r.querySelector(".event__score--away") : null;
+    if (withScores && (!hs || !as)) {
+      const scores = r.querySelectorAll(".event__score");
+      hs = scores[0];
+      as = scores[1];
+    }
+    return {
+      home: best(r.querySelector(".event__participant--home")),
+      away: best(r.querySelector(".event__participant--away")),
+      text: r.innerText || "",
+      hs: hs ? hs.innerText : null,
+      as: as ? as.innerText : null,
+    };
+  });
+}
+"""
+
+async def parse_rows_to_items(page, status: str):
     items = []
-    count = min(await rows.count(), 800)
+    try:
+        rows = await page.evaluate(ROWS_EXTRACT_JS, [".event__match", MAX_ROWS, status == "FT"])
+    except:
+        return items
 
-    for i in range(count):
-        row = rows.nth(i)
+    for row in rows:
         try:
-            hloc = row.locator(".event__participant--home").first
-            aloc = row.locator(".event__participant--away").first
-            if await hloc.count() == 0 or await aloc.count() == 0:
+            if row["home"] is None or row["away"] is None:
                 continue
 
-            home = await _get_best_text(hloc)
-            away = await _get_best_text(aloc)
-            if _is_bad_team(home) or _is_bad_team(away):
+            # no "Mon DD" in the row text -> not a match row, skip everything else
+            txt = (row["text"] or "").strip()
+            dm = DATE_RE.search(txt)
+            if not dm:
                 continue
-
-            try:
-                txt = (await row.inner_text()).strip()
-            except:
-                txt = ""
-            if not txt or "Advertisement" in txt or "We Care About Your Privacy" in txt:
+            if "Advertisement" in txt or "We Care About Your Privacy" in txt:
                 continue
 
-            dm = re.search(rf"\b{MONTH_RE}\s+(\d{{1,2}})\b", txt)
-            if not dm:
+            home = _clean(row["home"])
+            away = _clean(row["away"])
+            if _is_bad_team(home) or _is_bad_team(away):
                 continue
+
             mon = dm.group(1)
             day = int(dm.group(2))
 
             kickoff_time = parse_kickoff_time_from_row_text(txt)
 
             round_num = None
-            rm = re.search(r"Round\s+(\d+)", txt, re.I)
+            rm = ROUND_RE.search(txt)
             if rm:
                 round_num = int(rm.group(1))
 
             home_score = None
             away_score = None
             if status == "FT":
-                hs_loc = row.locator(".event__score--home").first
-                as_loc = row.locator(".event__score--away").first
-
-                if await hs_loc.count() == 0 or await as_loc.count() == 0:
-                    hs_loc = row.locator(".event__score").nth(0)
-                    as_loc = row.locator(".event__score").nth(1)
-
-                if await hs_loc.count() == 0 or await as_loc.count() == 0:
+                if row["hs"] is None or row["as"] is None:
                     continue
 
-                hs = _clean(await hs_loc.inner_text())
-                a_s = _clean(await as_loc.inner_text())
-                if not re.fullmatch(r"\d{1,3}", hs) or not re.fullmatch(r"\d{1,3}", a_s):
+                hs = _clean(row["hs"])
+                a_s = _clean(row["as"])
+                if not SCORE_RE.fullmatch(hs) or not SCORE_RE.fullmatch(a_s):
                     continue
 
                 home_score = int(hs)
@@ -429,6 +587,19 @@ async def parse_rows_to_items(page, rows, status: str):
 
     return items
 
+async def open_events_page(page, url: str, tag: str = "") -> bool:
+    # "commit" returns as soon as the response starts; the .event__match wait
+    # is what actually gates parsing, so slow third-party JS can't hold us up.
+    # cookies go after that wait since the banner isn't there at commit time.
+    await page.goto(url, wait_until="commit", timeout=60000)
+    try:
+        await page.wait_for_selector(".event__match", timeout=15000)
+    except PlaywrightTimeoutError:
+        print(f"{tag} ⚠️ no matches rendered: {url}")
+        return False
+    await accept_cookies_if_any(page)
+    return True
+
 async def scrape_competition(page, comp: dict):
     now_utc = datetime.now(timezone.utc)
     season_fallback = infer_season_fallback(now_utc)
@@ -437,19 +608,11 @@ async def scrape_competition(page, comp: dict):
     fixtures_items = []
     season_name = season_fallback
 
-    if comp.get("results_url"):
-        await page.goto(comp["results_url"], wait_until="domcontentloaded", timeout=60000)
-        await accept_cookies_if_any(page)
-        try:
-            await page.wait_for_selector(".event__match", timeout=15000)
-        except PlaywrightTimeoutError:
-            await page.wait_for_timeout(2000)
-
+    if comp.get("results_url") and await open_events_page(page, comp["results_url"], tag=f"[{comp['slug']}]"):
         await expand_all_events(page)
         season_name = await detect_season_name(page, fallback=season_fallback)
 
-        rows = page.locator(".event__match")
-        parsed = await parse_rows_to_items(page, rows, status="FT")
+        parsed = await parse_rows_to_items(page, status="FT")
         for it in parsed:
             it["match_date"] = build_match_date(season_name, it["month"], it["day"])
             it["source_event_key"] = build_source_event_key(
@@ -457,19 +620,11 @@ async def scrape_competition(page, comp: dict):
             )
         results_items = parsed
 
-    if comp.get("fixtures_url"):
-        await page.goto(comp["fixtures_url"], wait_until="domcontentloaded", timeout=60000)
-        await accept_cookies_if_any(page)
-        try:
-            await page.wait_for_selector(".event__match", timeout=15000)
-        except PlaywrightTimeoutError:
-            await page.wait_for_timeout(2000)
-
+    if comp.get("fixtures_url") and await open_events_page(page, comp["fixtures_url"], tag=f"[{comp['slug']}]"):
         await expand_all_events(page)
         season_name = await detect_season_name(page, fallback=season_name)
 
-        rows = page.locator(".event__match")
-        parsed = await parse_rows_to_items(page, rows, status="NS")
+        parsed = await parse_rows_to_items(page, status="NS")
         for it in parsed:
             it["match_date"] = build_match_date(season_name, it["month"], it["day"])
             it["source_event_key"] = build_source_event_key(
@@ -483,80 +638,161 @@ async def scrape_competition(page, comp: dict):
 # -------------------------
 # MAIN
 # -------------------------
-async def main():
-    comps = get_competitions_with_urls()
-    print(f"Found competitions with URLs: {len(comps)}")
+SCRAPE_CONCURRENCY = 6
+
+# headless scraping flags; one browser is launched per run and shared by every tab
+CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-extensions",
+    "--disable-features=TranslateUI,BackForwardCache",
+    "--blink-settings=imagesEnabled=false",
+]
+
+# container/root-only workarounds (no sandbox, /tmp instead of a tiny /dev/shm);
+# keep the sandbox on for normal runs since we render third-party ad pages
+if os.environ.get("SCRAPE_IN_CONTAINER") == "1":
+    CHROMIUM_ARGS += ["--no-sandbox", "--disable-dev-shm-usage"]
+
+# scraping only reads text nodes, so skip everything that's just pixels or tracking.
+# stylesheets stay allowed: "Show more" clicks and scroll loading rely on real layout.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_URL_PARTS = ("google-analytics", "googletagmanager", "doubleclick", "googlesyndication")
+
+async def _block_noise(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(part in req.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_scrape_context(browser):
+    context = await browser.new_context(
+        viewport={"width": 1280, "height": 900},
+        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36",
+    )
+    await context.route("**/*", _block_noise)
+    return context
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            viewport={"width": 1280, "height": 900},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36",
+# scraped comps waiting for upload; bounded so scrapers can't run far ahead
+UPLOAD_QUEUE_SIZE = 4
+
+async def scrape_comp(browser, comp: dict, sem: asyncio.Semaphore, queue: asyncio.Queue):
+    # each comp gets its own context/tab; the semaphore caps open tabs
+    async with sem:
+        tag = f"[{comp['slug']}]"
+        print(f"{tag} scraping {comp['name']}")
+
+        context = await new_scrape_context(browser)
+        try:
+            page = await context.new_page()
+            season_name, results_items, fixtures_items = await scrape_competition(page, comp)
+        except Exception as e:
+            print(f"{tag} ❌ scrape failed -> {repr(e)}")
+            return
+        finally:
+            await context.close()
+
+    unique = dedupe_items(results_items + fixtures_items)
+    results_items = [it for it in unique if it["status"] == "FT"]
+    fixtures_items = [it for it in unique if it["status"] != "FT"]
+
+    print(f"\n{tag} === {comp['name']} ({comp['slug']}) ===")
+    print(f"{tag} season: {season_name}")
+    print(f"{tag} parsed results: {len(results_items)}")
+    if results_items[:3]:
+        print(f"{tag} results preview:", results_items[:3])
+    print(f"{tag} parsed fixtures: {len(fixtures_items)}")
+    if fixtures_items[:3]:
+        print(f"{tag} fixtures preview:", fixtures_items[:3])
+
+    # dump parsed matches
+    jsonl_path, summary_path = make_log_paths(comp["slug"], season_name)
+    write_jsonl(jsonl_path, results_items + fixtures_items)
+    print(f"{tag} 📝 wrote local dump: {jsonl_path}")
+
+    # tab slot is already released, so waiting on a full queue doesn't block other scrapes
+    await queue.put((comp, season_name, results_items, fixtures_items, summary_path))
+
+async def upload_comp(comp: dict, season_name: str, results_items: list, fixtures_items: list, summary_path: str):
+    tag = f"[{comp['slug']}]"
+    season_id = await get_or_create_season(comp["id"], season_name)
+
+    upsert_ok = 0
+    upsert_fail = 0
+
+    if results_items and comp.get("results_url"):
+        ok, fail = await upsert_matches_bulk(
+            season_id=season_id,
+            competition_slug=comp["slug"],
+            season_name=season_name,
+            items=results_items,
+            source_url=comp["results_url"],
+        )
+        upsert_ok += ok
+        upsert_fail += fail
+
+    if fixtures_items and comp.get("fixtures_url"):
+        ok, fail = await upsert_matches_bulk(
+            season_id=season_id,
+            competition_slug=comp["slug"],
+            season_name=season_name,
+            items=fixtures_items,
+            source_url=comp["fixtures_url"],
         )
-        page = await context.new_page()
+        upsert_ok += ok
+        upsert_fail += fail
+
+    write_summary(
+        summary_path,
+        comp=comp,
+        season_name=season_name,
+        results_items=results_items,
+        fixtures_items=fixtures_items,
+        upsert_ok=upsert_ok,
+        upsert_fail=upsert_fail,
+    )
+    print(f"{tag} 📝 wrote summary: {summary_path}")
+    print(f"{tag} ✅ upsert done (ok={upsert_ok}, fail={upsert_fail})")
+
+async def run_scrapers(browser, comps: list, queue: asyncio.Queue):
+    sem = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+    results = await asyncio.gather(
+        *[scrape_comp(browser, comp, sem, queue) for comp in comps],
+        return_exceptions=True,
+    )
+    for comp, res in zip(comps, results):
+        if isinstance(res, Exception):
+            print(f"[{comp['slug']}] ❌ scrape failed -> {repr(res)}")
+    # sentinel: no more comps coming
+    await queue.put(None)
+
+async def run_uploader(queue: asyncio.Queue):
+    while True:
+        job = await queue.get()
+        if job is None:
+            return
+        try:
+            await upload_comp(*job)
+        except Exception as e:
+            print(f"[{job[0]['slug']}] ❌ upload failed -> {repr(e)}")
 
-        for comp in comps:
-            print(f"\n=== {comp['name']} ({comp['slug']}) ===")
+async def main():
+    await init_supabase()
+    comps = await get_competitions_with_urls()
+    print(f"Found competitions with URLs: {len(comps)}")
+    await prefetch_seasons([c["id"] for c in comps])
 
-            try:
-                season_name, results_items, fixtures_items = await scrape_competition(page, comp)
-            except Exception as e:
-                print(f"❌ scrape failed: {comp['slug']} -> {repr(e)}")
-                continue
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=CHROMIUM_ARGS)
 
-            print(f"season: {season_name}")
-            print(f"parsed results: {len(results_items)}")
-            if results_items[:3]:
-                print("results preview:", results_items[:3])
-            print(f"parsed fixtures: {len(fixtures_items)}")
-            if fixtures_items[:3]:
-                print("fixtures preview:", fixtures_items[:3])
-
-            # dump parsed matches
-            jsonl_path, summary_path = make_log_paths(comp["slug"], season_name)
-            write_jsonl(jsonl_path, results_items + fixtures_items)
-            print(f"📝 wrote local dump: {jsonl_path}")
-
-            season_id = get_or_create_season(comp["id"], season_name)
-
-            upsert_ok = 0
-            upsert_fail = 0
-
-            if results_items and comp.get("results_url"):
-                ok, fail = upsert_matches_bulk(
-                    season_id=season_id,
-                    competition_slug=comp["slug"],
-                    season_name=season_name,
-                    items=results_items,
-                    source_url=comp["results_url"],
-                )
-                upsert_ok += ok
-                upsert_fail += fail
-
-            if fixtures_items and comp.get("fixtures_url"):
-                ok, fail = upsert_matches_bulk(
-                    season_id=season_id,
-                    competition_slug=comp["slug"],
-                    season_name=season_name,
-                    items=fixtures_items,
-                    source_url=comp["fixtures_url"],
-                )
-                upsert_ok += ok
-                upsert_fail += fail
-
-            write_summary(
-                summary_path,
-                comp=comp,
-                season_name=season_name,
-                results_items=results_items,
-                fixtures_items=fixtures_items,
-                upsert_ok=upsert_ok,
-                upsert_fail=upsert_fail,
-            )
-            print(f"📝 wrote summary: {summary_path}")
-            print(f"✅ upsert done (ok={upsert_ok}, fail={upsert_fail})")
+        # scraping the next comps overlaps with upserting the ones already scraped
+        queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(run_scrapers(browser, comps, queue))
+            tg.create_task(run_uploader(queue))
 
-        await context.close()
         await browser.close()
 
     print("\n✅ done")